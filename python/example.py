@@ -11,7 +11,14 @@ cur_time = time.time()
 bam = BamReader(filename)
 bam.createIndex()
 print("References: %s" % bam.references)
-print("Number of reads: %s" % sum(1 for _ in bam.reads()))
+n_reads = sum(1 for _ in bam.reads(reuse=True))
+print("Number of reads: %s" % n_reads)
+
+reads = bam.reads(cursor=True)
+for _ in xrange(n_reads // 2):
+    reads.next()
+cursor = reads.cursor
+assert(sum(1 for _ in BamReader(filename).reads(start=cursor)) == n_reads - n_reads // 2)
 print("===========")
 print("SAM header:")
 print(bam.header)
@@ -31,9 +38,13 @@ for column in Pileup(reads, use_md=True):
 
               
 new_fn = filename + ".v1"        
+bg_fn = filename + ".v1.bg"
 w = BamWriter(new_fn, threads=2)
-w.writeHeader(bam.header)
-w.writeRefs(bam.references)
+# same reads, serialized and compressed in a background thread
+bg_w = BamWriter(bg_fn, threads=2, background=True)
+for writer in (w, bg_w):
+    writer.writeHeader(bam.header)
+    writer.writeRefs(bam.references)
 for r in bam.reads():
     if r.tag('NM') > 2:
         r.setInt16Tag('NM', -42)
@@ -43,7 +54,15 @@ for r in bam.reads():
         r.cigar = [CigarOperation(333, 'M'), CigarOperation(333, 'S')]
         r.setStringTag('XW', "this read is weird")
     w.writeRead(r)
+    bg_w.writeRead(r)
 w.close()
+bg_w.close()
+
+sync_reads = [repr(r) for r in BamReader(new_fn).reads()]
+bg_reads = [repr(r) for r in BamReader(bg_fn).reads()]
+assert(len(sync_reads) == len(bg_reads))
+assert(all(a == b for a, b in zip(sync_reads, bg_reads)))
+os.unlink(bg_fn)
 
 new_bam = BamReader(new_fn)
 print("Reads with NM == -42: %s" % sum(1 for r in new_bam.reads() if r.tag('NM') == -42))
@@ -56,6 +75,42 @@ for read in new_bam.reads():
         assert(read.base_qualities == [25] * 1000)
 
 os.unlink(new_fn)
+
+markdup_fn = filename + ".markdup"
+metrics = mark_duplicates(filename, markdup_fn, threads=2)
+print("Duplicates: %s" % metrics)
+assert(sum(1 for r in BamReader(markdup_fn).reads() if r.is_duplicate) == \
+       metrics.unpaired_read_duplicates + 2 * metrics.read_pair_duplicates)
+os.unlink(markdup_fn)
+
+# 5' ends include clipped bases, whatever clips were seen before:
+# reads at 2000 (50M) and 2005 (5S45M) are duplicates of each other
+clipped_fn = filename + ".clipped"
+template = bam.reads().next()
+w = BamWriter(clipped_fn)
+w.writeHeader("@HD\tVN:1.3\tSO:coordinate\n")
+w.writeRefs(bam.references)
+for name, pos, cigar, qual in [("noclip", 2000, [CigarOperation(50, 'M')], 30),
+                               ("clipped", 2005, [CigarOperation(5, 'S'),
+                                                  CigarOperation(45, 'M')], 20)]:
+    r = template.copy()
+    r.name = name
+    r.flags = 0
+    r.reference_id = 0
+    r.position = pos
+    r.mate_reference_id = -1
+    r.mate_position = -1
+    r.template_length = 0
+    r.sequence = "A" * 50
+    r.base_qualities = [qual] * 50
+    r.cigar = cigar
+    w.writeRead(r)
+w.close()
+metrics = mark_duplicates(clipped_fn, markdup_fn)
+assert(metrics.unpaired_read_duplicates == 1)
+assert([r.name for r in BamReader(markdup_fn).reads() if r.is_duplicate] == ["clipped"])
+os.unlink(clipped_fn)
+os.unlink(markdup_fn)
 os.unlink(filename + ".bai")
 
 exec_time = time.time() - cur_time
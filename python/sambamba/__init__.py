@@ -232,6 +232,16 @@ class ReadOnlyBamRead(object):
     def is_duplicate(self):
         return _lib.bam_read_is_duplicate(self._d_read)
 
+    def copy(self):
+        """
+        Modifiable copy of the read which owns its data
+        (use it to keep reads obtained with reuse=True or from a pileup)
+        """
+        sz = self._d_read.len
+        data = _ffi.new(_byteType, sz)
+        _lib.bam_read_copy_into(self._d_read, data)
+        return BamRead(data, sz, self._d_read.reader)
+
 class BamRead(ReadOnlyBamRead):
     """
     Modifiable BAM read
@@ -392,8 +402,19 @@ class BamRead(ReadOnlyBamRead):
 
 
 class BamReadDRange(object):
-    def __init__(self, creads):
+    def __init__(self, creads, reuse=False):
+        """
+        If reuse is True, the same read object and buffer are returned
+        by each call to next(), so that no memory is allocated per read
+        (the buffer grows only when a read doesn't fit into it).
+        The read is then valid only until the next call to next(),
+        use its copy() method to keep it.
+        """
         self._d_reads = creads
+        self._reuse = reuse
+        self._buf = None
+        self._buf_size = 0
+        self._read = None
 
     def __del__(self):
         _lib.d_free(self._d_reads) 
@@ -407,16 +428,52 @@ class BamReadDRange(object):
         sz = _lib.bam_readrange_front_alloc_size(self._d_reads)
         if sz == 0: # empty
             raise StopIteration
+        if self._reuse:
+            return self._next_reused(sz)
         data = _ffi.new(_byteType, sz)
         reader = _lib.bam_readrange_front_copy_into_and_pop_front(self._d_reads, data)
         read = BamRead(data, sz, reader)
         return read
 
+    def _next_reused(self, sz):
+        if sz > self._buf_size:
+            self._buf_size = max(sz, 2 * self._buf_size)
+            self._buf = _ffi.new(_byteType, self._buf_size)
+        reader = _lib.bam_readrange_front_copy_into_and_pop_front(self._d_reads, self._buf)
+        read = self._read
+        if read is None:
+            read = self._read = BamRead(self._buf, sz, reader)
+        else:
+            # setters might have replaced the buffer, bring it back
+            read._d_read.len = sz
+            read._d_read.buf = read._c_data = self._buf
+            read._d_read.reader = reader
+        return read
+
+    @property
+    def cursor(self):
+        """
+        Virtual offset of the next read, which can be passed
+        to BamReader.reads(start=...) in order to resume iteration.
+        Available only for ranges returned by BamReader.reads
+        with cursor=True or start=...
+        """
+        cursor = _ffi.new("uint64_t *")
+        if _lib.bam_readrange_cursor(self._d_reads, cursor) < 0:
+            raise BamReaderException()
+        return cursor[0]
+
 class BamReaderException(Exception):
     def __init__(self):
         self.args = (_ffi.string(_lib.last_error_message()),)
 
 class BamWriterException(Exception):
+    def __init__(self, message=None):
+        if message is None:
+            message = _ffi.string(_lib.last_error_message())
+        self.args = (message,)
+
+class MarkDuplicatesException(Exception):
     def __init__(self):
         self.args = (_ffi.string(_lib.last_error_message()),)
 
@@ -434,14 +491,14 @@ class BamReferenceSequence(object):
     def __repr__(self):
         return "(%s) %s - length %sbp" % (self.id, self.name, self.length)
 
-    def fetch(self, start, end):
+    def fetch(self, start, end, reuse=False):
         p = _lib.bam_reader_fetch(self._d_bam, self.name, start, end)
         if p == _ffi.NULL:
             raise BamReaderException()
-        return BamReadDRange(p)
+        return BamReadDRange(p, reuse)
 
-    def reads(self):
-        return self.fetch(0, self.length)
+    def reads(self, reuse=False):
+        return self.fetch(0, self.length, reuse)
 
 class BamReader(object):
     def __init__(self, filename, threads=1):
@@ -483,29 +540,60 @@ class BamReader(object):
     def createIndex(self, overwrite_if_exists=False):
         _lib.bam_reader_create_index(self._d_bam, overwrite_if_exists)
 
-    def reads(self):
-        p = _lib.bam_reader_reads(self._d_bam)
+    def reads(self, start=None, reuse=False, cursor=False):
+        """
+        If cursor is True, the returned range provides cursor property
+        (tracking read offsets makes iteration a bit slower).
+        If start is provided, it must be a cursor of a range of reads 
+        from the same file, and iteration begins from the read it points to
+        (such range always provides cursor property).
+        See BamReadDRange for the meaning of reuse.
+        """
+        if start is not None:
+            p = _lib.bam_reader_reads_from(self._d_bam, start)
+        elif cursor:
+            p = _lib.bam_reader_reads_with_cursor(self._d_bam)
+        else:
+            p = _lib.bam_reader_reads(self._d_bam)
         if p == _ffi.NULL:
             raise BamReaderException()
-        return BamReadDRange(p)
+        return BamReadDRange(p, reuse)
 
-    def fetch(self, reference_name, start, end):
+    def fetch(self, reference_name, start, end, reuse=False):
         p = _lib.bam_reader_fetch(self._d_bam, reference_name, start, end)
         if p == _ffi.NULL:
             raise BamReaderException()
-        return BamReadDRange(p)
+        return BamReadDRange(p, reuse)
 
     def __iter__(self):
         return self.reads()
 
 class BamWriter(object):
-    def __init__(self, filename, threads=1, compression_level=-1):
+    def __init__(self, filename, threads=1, compression_level=-1,
+                 background=False, queue_bytes=16*1024*1024):
+        """
+        Header and reference sequences must be written before reads.
+
+        If background is True, reads are written in a separate native thread,
+        which takes them from a queue of at most queue_bytes bytes; writeRead
+        blocks only when the queue is full. Errors from the thread are raised
+        by writeRead or close. The thread is started by the first writeRead,
+        after that writeHeader and writeRefs raise BamWriterException.
+        """
         self._task_pool = _lib.task_pool_new(threads)
         self._d_writer = _lib.bam_writer_new2(filename, compression_level, self._task_pool)
         if self._d_writer == _ffi.NULL:
             raise BamWriterException()
+        self._background = background
+        self._queue_bytes = queue_bytes
+        self._d_bg_writer = _ffi.NULL
+
+    def _check_no_reads_written(self):
+        if self._d_bg_writer != _ffi.NULL:
+            raise BamWriterException("Background writing of reads has already started")
 
     def writeHeader(self, sam_header_text):
+        self._check_no_reads_written()
         d_header = _lib.sam_header_new(sam_header_text)
         if d_header == _ffi.NULL:
             raise BamWriterException()
@@ -518,6 +606,7 @@ class BamWriter(object):
         """
         references must be a list of BamReferenceSequence objects
         """
+        self._check_no_reads_written()
         n = len(references)
         info = _ffi.new("reference_info_s[]", n)
         for i, ref in enumerate(references):
@@ -529,7 +618,15 @@ class BamWriter(object):
             raise BamWriterException()
 
     def writeRead(self, read):
-        ret = _lib.bam_writer_push_read(self._d_writer, read._d_read)
+        if self._background and self._d_bg_writer == _ffi.NULL:
+            self._d_bg_writer = _lib.bam_background_writer_new(self._d_writer,
+                                                               self._queue_bytes)
+            if self._d_bg_writer == _ffi.NULL:
+                raise BamWriterException()
+        if self._d_bg_writer != _ffi.NULL:
+            ret = _lib.bam_background_writer_push_read(self._d_bg_writer, read._d_read)
+        else:
+            ret = _lib.bam_writer_push_read(self._d_writer, read._d_read)
         if ret < 0:
             raise BamWriterException()
 
@@ -537,12 +634,21 @@ class BamWriter(object):
         """
         Flush the buffers and append EOF block
         """
+        if self._d_bg_writer != _ffi.NULL:
+            ret = _lib.bam_background_writer_close(self._d_bg_writer)
+            if ret < 0:
+                raise BamWriterException()
+            return
         ret = _lib.bam_writer_close(self._d_writer)
         if ret < 0:
             raise BamWriterException()
 
     def __del__(self):
-        _lib.bam_writer_close(self._d_writer)
+        if self._d_bg_writer != _ffi.NULL:
+            _lib.bam_background_writer_close(self._d_bg_writer)
+            _lib.d_free(self._d_bg_writer)
+        else:
+            _lib.bam_writer_close(self._d_writer)
         _lib.task_pool_finish(self._task_pool)
         _lib.d_free(self._task_pool)
         _lib.d_free(self._d_writer)
@@ -676,3 +782,50 @@ class PileupRead(ReadOnlyBamRead):
     def cigar_after(self):
         d_cigar = _lib.bam_pileup_read_cigar_after(self._d_addr)
         return [CigarOperation._raw(op) for op in d_cigar.buf[0:d_cigar.len]]
+
+class DuplicationMetrics(object):
+    def __init__(self, cstruct):
+        self.unpaired_reads_examined = cstruct.unpaired_reads_examined
+        self.read_pairs_examined = cstruct.read_pairs_examined
+        self.secondary_or_supplementary_reads = cstruct.secondary_or_supplementary_reads
+        self.unmapped_reads = cstruct.unmapped_reads
+        self.unpaired_read_duplicates = cstruct.unpaired_read_duplicates
+        self.read_pair_duplicates = cstruct.read_pair_duplicates
+
+    @property
+    def percent_duplication(self):
+        """
+        Fraction of examined reads marked as duplicates (between 0 and 1)
+        """
+        examined = self.unpaired_reads_examined + 2 * self.read_pairs_examined
+        if examined == 0:
+            return 0.0
+        dups = self.unpaired_read_duplicates + 2 * self.read_pair_duplicates
+        return float(dups) / examined
+
+    def __repr__(self):
+        return "%s/%s unpaired reads and %s/%s read pairs are duplicates (%.2f%%)" % \
+                (self.unpaired_read_duplicates, self.unpaired_reads_examined,
+                 self.read_pair_duplicates, self.read_pairs_examined,
+                 self.percent_duplication * 100)
+
+def mark_duplicates(input, output, threads=1, remove=False, compression_level=-1,
+                    max_clip=10000):
+    """
+    Marks duplicates in a coordinate-sorted BAM file, writing the result to output.
+    The whole work is done in native code, reads don't cross the FFI boundary.
+    If remove is True, duplicates are not written at all.
+    max_clip is the initial window for keeping groups of reads in memory;
+    reads with longer clips at their 5' end make the analysis start over
+    with a wider window.
+    Returns DuplicationMetrics object.
+    """
+    task_pool = _lib.task_pool_new(threads)
+    metrics = _ffi.new("duplication_metrics_s *")
+    ret = _lib.bam_mark_duplicates(input, output, task_pool,
+                                   compression_level, remove, max_clip, metrics)
+    _lib.task_pool_finish(task_pool)
+    _lib.d_free(task_pool)
+    if ret < 0:
+        raise MarkDuplicatesException()
+    return DuplicationMetrics(metrics)
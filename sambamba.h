@@ -85,6 +85,13 @@ bam_readrange_front_copy_into_and_pop_front(bam_read_range_t, const uint8_t* buf
 /* FIXME: currently, the latter function doesn't catch any exceptions.
          That is, if the file is somehow broken, it will just segfault. */
 
+/* Cursor is the BGZF virtual offset of the next read in the range
+   (or of the end of data, if the range is empty); iteration can be resumed
+   from it with bam_reader_reads_from. Only ranges created with
+   bam_reader_reads_with_cursor and bam_reader_reads_from support cursors.
+   Returns 0 if everything is OK, otherwise -1. */
+int32_t bam_readrange_cursor(bam_read_range_t, uint64_t* cursor);
+
 /* ------------------ Reference sequence information ------------------------ */
 typedef struct {
     size_t name_len; /* length of reference sequence name */
@@ -123,6 +130,14 @@ void bam_reader_create_index(bam_reader_t, bool force);
 /* all reads in the BAM file */
 bam_read_range_t bam_reader_reads(bam_reader_t);
 
+/* same, but the range keeps track of virtual offsets of reads
+   and supports bam_readrange_cursor */
+bam_read_range_t bam_reader_reads_with_cursor(bam_reader_t);
+
+/* all reads starting from a cursor obtained with bam_readrange_cursor
+   (possibly from another reader of the same file) */
+bam_read_range_t bam_reader_reads_from(bam_reader_t, uint64_t cursor);
+
 /* fetch reads overlapping a region */
 bam_read_range_t 
 bam_reader_fetch(bam_reader_t, char* refname, uint32_t from, uint32_t to);
@@ -132,6 +147,11 @@ areference_info_s bam_reader_references(bam_reader_t);
 
 /* --------------------------------- BAM read ------------------------------- */
 
+/* copy raw data of the read into a buffer of bam_read_s.len bytes;
+   unlike memcpy, makes the copy own its data
+   (D setters won't try to reallocate it) */
+void bam_read_copy_into(const bam_read_t, uint8_t* buffer);
+
 /* get SAM representation of the read */
 dstring_s* df_bam_read_to_sam(bam_read_t);
 
@@ -380,3 +400,53 @@ int32_t bam_writer_close(bam_writer_t);
 
 /* flushes current BGZF block; may be useful in some cases */
 int32_t bam_writer_flush(bam_writer_t);
+
+/* -------------------------- Background writer ----------------------------- */
+typedef void* bam_background_writer_t;
+
+/* Reads pushed to the background writer are copied into a queue
+   and written to the BAM writer in a dedicated thread, so that
+   serialization and compression overlap with the caller's work.
+   The queue holds at most queue_bytes of data; when it is full,
+   pushing blocks until the thread catches up.
+   Header and reference sequences must be written to the BAM writer
+   before the first read is pushed; the BAM writer must not be used
+   directly afterwards.
+   NULL return value indicates that an exception has occurred. */
+bam_background_writer_t bam_background_writer_new(bam_writer_t, size_t queue_bytes);
+
+/* 0 if everything is OK, otherwise -1 (errors in the thread are reported
+   by the next call to this function or to the one below) */
+int32_t bam_background_writer_push_read(bam_background_writer_t, bam_read_t);
+
+/* waits for the thread to write everything and close the BAM writer;
+   can be called more than once. Returns 0 or -1. */
+int32_t bam_background_writer_close(bam_background_writer_t);
+
+/* ------------------------- Duplicate marking ------------------------------ */
+typedef struct {
+    uint64_t unpaired_reads_examined;
+    uint64_t read_pairs_examined;
+    uint64_t secondary_or_supplementary_reads;
+    uint64_t unmapped_reads;
+    uint64_t unpaired_read_duplicates;
+    uint64_t read_pair_duplicates;
+} duplication_metrics_s;
+
+/* Marks duplicate reads in a coordinate-sorted BAM file and writes the result
+   to another file, with the same header and reference sequences.
+   Pairs are compared by 5' ends of both mates, unpaired reads by their own
+   5' end (clipped bases included); reads from different libraries, according
+   to RG tags and @RG lines, are never duplicates of each other.
+   Secondary and supplementary alignments are duplicates iff their
+   primary alignments are.
+   If remove is true, duplicates are dropped instead of being flagged.
+   Groups of reads are kept until they are max_clip bases behind the current
+   position; a read clipped by more than that at its 5' end makes the first
+   pass over the file start over with a wider window.
+   The task pool is used both for decompression and compression.
+   Returns 0 and fills the metrics if everything is OK, otherwise -1
+   (then the output file is removed). */
+int32_t bam_mark_duplicates(const char* input, const char* output, task_pool_t,
+                            int32_t compression_level, bool remove,
+                            int32_t max_clip, duplication_metrics_s* metrics);